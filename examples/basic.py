@@ -49,6 +49,8 @@ app.include_router(
 )
 
 # run the app with uvicorn
+# (with `uvicorn[standard]` installed, the faster httptools parser and uvloop
+# event loop are picked automatically, which helps large PATCH bodies)
 if __name__ == "__main__":
     uvicorn.run(
         "basic:app",
@@ -0,0 +1,40 @@
+import ctypes
+import ctypes.util
+import sys
+
+# fallocate(2) mode flag: reserve blocks without changing the file size
+FALLOC_FL_KEEP_SIZE = 0x01
+
+
+def _load_fallocate():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except OSError:
+        return None
+
+    # prefer the explicit 64-bit variant; plain fallocate only takes a 64-bit
+    # offset where off_t is 64 bits wide
+    fallocate = getattr(libc, "fallocate64", None)
+    if fallocate is None and ctypes.sizeof(ctypes.c_long) == 8:
+        fallocate = getattr(libc, "fallocate", None)
+    if fallocate is None:
+        return None
+
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    fallocate.restype = ctypes.c_int
+    return fallocate
+
+
+_fallocate = _load_fallocate()
+
+
+# Reserve `size` bytes of disk for `fd` up front so the filesystem can lay the
+# upload out in one go. The apparent file size is left untouched, so appends
+# and size-based offset checks keep working. Best-effort: returns False where
+# fallocate(2) is unavailable or unsupported by the filesystem.
+def preallocate(fd: int, size: int) -> bool:
+    if _fallocate is None or size <= 0:
+        return False
+    return _fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, size) == 0
@@ -1,12 +1,12 @@
+from dataclasses import dataclass
 from typing import Any, Hashable
 
-from pydantic import BaseModel
 
-
-class FileMetadata(BaseModel):
+@dataclass(slots=True, kw_only=True)
+class FileMetadata:
     uid: str
     metadata: dict[Hashable, str]
-    size: int
+    size: int | None
     offset: int = 0
     upload_part: int = 0
     created_at: str
@@ -14,13 +14,16 @@ class FileMetadata(BaseModel):
     upload_chunk_size: int = 0
     expires: float | str | None
     error: str | None = None
+    filename: str | None = None
+    filetype: str | None = None
+    upload_metadata: str | None = None
 
     @classmethod
     def from_request(
         cls,
         uid: str,
         metadata: dict[Any, str],
-        size: int,
+        size: int | None,
         created_at: str,
         defer_length: bool,
         expires: float | str | None,
@@ -0,0 +1,45 @@
+import os
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+
+# A FileResponse that hands the file descriptor to the ASGI server when it
+# advertises the zero-copy extension, so the server can sendfile() the body
+# instead of copying it through Python. HEAD and range requests, and servers
+# without the extension, fall back to the regular FileResponse.
+class ZeroCopyFileResponse(FileResponse):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or ZEROCOPY_EXTENSION not in scope.get("extensions", {})
+            or scope["method"].upper() == "HEAD"
+            or "range" in Headers(scope=scope)
+        ):
+            await super().__call__(scope, receive, send)
+            return
+
+        with open(self.path, "rb") as f:
+            stat_result = self.stat_result or os.fstat(f.fileno())
+            self.set_stat_headers(stat_result)
+
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": self.raw_headers,
+                }
+            )
+            await send(
+                {
+                    "type": ZEROCOPY_EXTENSION,
+                    "file": f,
+                    "count": stat_result.st_size,
+                }
+            )
+
+        if self.background is not None:
+            await self.background()
@@ -1,8 +1,13 @@
+import asyncio
 import base64
+import binascii
 import inspect
 import json
 import os
+import re
 from asyncio import log
+from contextlib import suppress
+from dataclasses import asdict, replace
 from datetime import datetime, timedelta
 from json import JSONDecodeError
 from typing import Callable, Optional
@@ -18,16 +23,71 @@ from fastapi import (
     Response,
     status,
 )
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import ClientDisconnect
-from starlette.responses import FileResponse
 
+from tuspyserver import fs
 from tuspyserver.metadata import FileMetadata
+from tuspyserver.responses import ZeroCopyFileResponse
+
+
+# one `key base64value` pair of the Upload-Metadata header; the value is
+# optional
+_METADATA_PAIR_RE = re.compile(r"\s*(\S+)(?:\s+([A-Za-z0-9+/]*={0,2}))?\s*")
 
 
 async def noop():
     pass
 
 
+def _parse_upload_metadata(upload_metadata: str) -> dict[str, str]:
+    metadata = {}
+    for pair in upload_metadata.split(","):
+        match = _METADATA_PAIR_RE.fullmatch(pair)
+        if match is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Malformed Upload-Metadata",
+            )
+
+        key, value = match.groups(default="")
+        try:
+            metadata[key] = base64.b64decode(value, validate=True).decode("utf-8")
+        except (binascii.Error, UnicodeDecodeError):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Upload-Metadata value for {key} is not base64-encoded UTF-8",
+            )
+
+    return metadata
+
+
+def _b64(s: str) -> str:
+    return base64.b64encode(s.encode("utf-8")).decode("ascii")
+
+
+def _resolve_file_info(metadata: dict) -> tuple[str, str]:
+    filename = metadata.get("filename", metadata.get("name"))
+    if filename is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Upload-Metadata missing required field: filename",
+        )
+
+    filetype = metadata.get("filetype", metadata.get("type"))
+    if filetype is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Upload-Metadata missing required field: filetype",
+        )
+
+    return filename, filetype
+
+
+def _encode_upload_metadata(filename: str, filetype: str) -> str:
+    return f"filename {_b64(filename)}, filetype {_b64(filetype)}"
+
+
 def create_tus_router(
     prefix: str = "files",
     files_dir="/tmp/files",
@@ -36,17 +96,49 @@ def create_tus_router(
     days_to_keep: int = 5,
     on_upload_complete: Optional[Callable[[str, dict], None]] = None,
     upload_complete_dep: Optional[Callable[..., Callable[[str, dict], None]]] = None,
-    tags: Optional[list[str]] = None
+    tags: Optional[list[str]] = None,
+    preallocate: bool = False,
 ):
     if prefix and prefix[0] == "/":
         prefix = prefix[1:]
     router = APIRouter(prefix=f"/{prefix}", redirect_slashes=True, tags=tags if tags else ["Tus"])
 
     tus_version = "1.0.0"
+    # flush buffered PATCH chunks once 1 MiB is pending, or before a single
+    # writev call would exceed the usual IOV_MAX of 1024 buffers
+    flush_bytes = 1 << 20
+    flush_chunks = 1024
     tus_extension = (
         "creation,creation-defer-length,creation-with-upload,expiration,termination"
     )
 
+    # OPTIONS headers never change for the lifetime of the router
+    upload_options_headers = {
+        "Tus-Extension": tus_extension,
+        "Tus-Resumable": tus_version,
+        "Tus-Version": tus_version,
+        "Content-Length": "0",
+    }
+    create_options_headers = {
+        **upload_options_headers,
+        "Tus-Max-Size": str(max_size),
+    }
+
+    # everything in the Location header after the host, minus the upload id
+    location_path = f"/{prefix}/"
+
+    # parsed .info sidecars by uid, validated against the sidecar's mtime and
+    # size so clients probing the same upload repeatedly skip the JSON load
+    metadata_cache: dict[str, tuple[int, int, FileMetadata]] = {}
+    metadata_cache_size = 1024
+
+    # pending expiry deletions by uid, cancelled when an upload goes early
+    expiry_timers: dict[str, tuple[asyncio.AbstractEventLoop, asyncio.TimerHandle]] = {}
+
+    # with both options given, on_upload_complete runs alongside the
+    # callback produced by upload_complete_dep
+    extra_on_complete = on_upload_complete if upload_complete_dep else None
+
     if upload_complete_dep is None:
 
         async def _fallback_on_complete_dep() -> Callable[[str, dict], None]:
@@ -54,57 +146,121 @@ def create_tus_router(
 
         upload_complete_dep = _fallback_on_complete_dep
 
+    async def _run_on_complete(
+        on_complete: Callable[[str, dict], None], file_path: str, metadata: dict
+    ) -> None:
+        for callback in (on_complete, extra_on_complete):
+            if callback is None:
+                continue
+            result = callback(file_path, metadata)
+            # if the callback returned a coroutine, await it
+            if inspect.isawaitable(result):
+                await result
+
     async def _get_request_chunk(
         request: Request, uuid: str = Path(...), post_request: bool = False
-    ) -> bool | None:
+    ) -> FileMetadata | None:
         meta = _read_metadata(uuid)
-        if not meta or not _file_exists(uuid):
-            return False
+        file_stat = _stat_file(uuid)
+        if not meta or file_stat is None:
+            return None
+        # stat once up front and track the size locally while writing. The
+        # sidecar is only saved once per request, so after a crash the file
+        # on disk is the source of truth for how much has been received.
+        file_size = file_stat.st_size
+        meta.offset = file_size
+
+        # reject oversized bodies before reading them when the length is known
+        content_length = request.headers.get("content-length")
+        if content_length is not None and content_length.isdigit():
+            if file_size + int(content_length) > max_size:
+                raise HTTPException(status_code=413)
 
         # Flag to track if we processed any chunks
         has_chunks = False
 
-        with open(f"{files_dir}/{uuid}", "ab") as f:
-            try:
-                async for chunk in request.stream():
-                    has_chunks = True
-                    # Skip empty chunks but continue processing
-                    if len(chunk) == 0:
-                        continue
-
-                    if _get_file_length(uuid) + len(chunk) > max_size:
-                        raise HTTPException(status_code=413)
-
-                    f.write(chunk)
-                    meta.offset += len(chunk)
-                    meta.upload_chunk_size = len(chunk)
-                    meta.upload_part += 1
-                    _write_metadata(meta)
-            except ClientDisconnect:
-                return False
-            except Exception as e:
-                meta.error = str(e)
-                _write_metadata(meta)
-                return False
-            finally:
-                f.close()
-
-        # For empty files in a POST request, we still want to return True
-        # to ensure _get_and_save_the_file gets called
+        # Chunks are buffered and flushed with a single scatter-write
+        pending: list[bytes] = []
+        pending_size = 0
+
+        async def flush() -> None:
+            nonlocal pending_size, file_size
+            if not pending:
+                return
+            # keep blocking disk writes off the event loop
+            await run_in_threadpool(_write_chunks, fd, pending)
+            file_size += pending_size
+            pending.clear()
+            pending_size = 0
+
+        fd = os.open(
+            os.path.join(files_dir, uuid), os.O_WRONLY | os.O_APPEND | os.O_CREAT
+        )
+        try:
+            async for chunk in request.stream():
+                has_chunks = True
+                # Skip empty chunks but continue processing
+                if len(chunk) == 0:
+                    continue
+
+                # the length may be unknown (chunked) or understated
+                if file_size + pending_size + len(chunk) > max_size:
+                    raise HTTPException(status_code=413)
+
+                pending.append(chunk)
+                pending_size += len(chunk)
+                meta.upload_chunk_size = len(chunk)
+                meta.upload_part += 1
+
+                if len(pending) >= flush_chunks or pending_size >= flush_bytes:
+                    await flush()
+            await flush()
+        except ClientDisconnect:
+            await flush()
+            meta.offset = file_size
+            await run_in_threadpool(_write_metadata, meta)
+            return meta
+        except HTTPException:
+            raise
+        except Exception as e:
+            meta.error = str(e)
+            meta.offset = file_size
+            await run_in_threadpool(_write_metadata, meta)
+            return meta
+        finally:
+            os.close(fd)
+
+        meta.offset = file_size
+
+        # For empty files in a POST request, we still want to record
+        # an upload part before _get_and_save_the_file gets called
         if post_request and not has_chunks:
             # Update metadata for empty file
             meta.offset = 0
             meta.upload_chunk_size = 0
             meta.upload_part += 1
-            _write_metadata(meta)
 
-        return True
+        await run_in_threadpool(_write_metadata, meta)
+        # hand the metadata to the route so it is not read from disk again
+        return meta
+
+    def _write_chunks(fd: int, chunks: list[bytes]) -> None:
+        written = os.writev(fd, chunks) if hasattr(os, "writev") else 0
+        total = sum(len(c) for c in chunks)
+        # writev may return early (or be missing, e.g. on Windows);
+        # write out whatever is left
+        if written < total:
+            view = memoryview(b"".join(chunks))[written:]
+            while view:
+                view = view[os.write(fd, view) :]
 
     @router.head("/{uuid}", status_code=status.HTTP_200_OK)
-    def get_upload_metadata(response: Response, uuid: str, _=Depends(auth)) -> Response:
+    async def get_upload_metadata(response: Response, uuid: str, _=Depends(auth)) -> Response:
         meta = _read_metadata(uuid)
-        if meta is None or not _file_exists(uuid):
+        file_stat = _stat_file(uuid)
+        if meta is None or file_stat is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+        meta.offset = file_stat.st_size
 
         if meta.error:
             raise HTTPException(
@@ -113,41 +269,26 @@ def create_tus_router(
             )
 
         if meta.size == meta.offset:
-            _delete_files(uuid)
+            await run_in_threadpool(_delete_files, uuid)
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
         response.headers["Tus-Resumable"] = tus_version
-        response.headers["Content-Length"] = str(meta.size)
-        response.headers["Upload-Length"] = str(meta.size)
+        if meta.size is None:
+            # the client has yet to declare the length in a PATCH
+            response.headers["Upload-Defer-Length"] = "1"
+        else:
+            response.headers["Content-Length"] = str(meta.size)
+            response.headers["Upload-Length"] = str(meta.size)
         response.headers["Upload-Offset"] = str(meta.offset)
         response.headers["Cache-Control"] = "no-store"
 
-        if "filename" in meta.metadata:
-            fn = meta.metadata["filename"]
-        elif "name" in meta.metadata:
-            fn = meta.metadata["name"]
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Upload-Metadata missing required field: filename"
-            )
-
-        if "filetype" in meta.metadata:
-            ft = meta.metadata["filetype"]
-        elif "type" in meta.metadata:
-            ft = meta.metadata["type"]
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Upload-Metadata missing required field: filetype"
+        upload_metadata = meta.upload_metadata
+        if upload_metadata is None:
+            # sidecars written before the header was stored on creation
+            upload_metadata = _encode_upload_metadata(
+                *_resolve_file_info(meta.metadata)
             )
-
-        def b64(s: str) -> str:
-            return base64.b64encode(s.encode("utf-8")).decode("ascii")
-
-        response.headers["Upload-Metadata"] = (
-            f"filename {b64(fn)}, filetype {b64(ft)}"
-        )
+        response.headers["Upload-Metadata"] = upload_metadata
 
         response.status_code = status.HTTP_200_OK
         return response
@@ -158,34 +299,30 @@ def create_tus_router(
         uuid: str,
         content_length: int = Header(None),
         upload_offset: int = Header(None),
-        _=Depends(_get_request_chunk),
+        upload_length: int = Header(None),
+        meta: FileMetadata | None = Depends(_get_request_chunk),
         __=Depends(auth),
         on_complete: Callable[[str, dict], None] = Depends(upload_complete_dep),
     ) -> Response:
         headers = _get_and_save_the_file(
             response,
             uuid,
+            meta,
             content_length,
-            upload_length=upload_offset,
+            upload_offset=upload_offset,
+            upload_length=upload_length,
         )
 
-        meta = _read_metadata(uuid)
-        if meta and meta.size == meta.offset:
+        # _get_and_save_the_file has validated and updated meta in place
+        if meta.size == meta.offset:
             file_path = os.path.join(files_dir, uuid)
-            result = on_complete(file_path, meta.metadata)
-            # if the callback returned a coroutine, await it
-            if inspect.isawaitable(result):
-                await result
+            await _run_on_complete(on_complete, file_path, meta.metadata)
 
         return headers
 
     @router.options("/", status_code=status.HTTP_204_NO_CONTENT)
-    def options_create_upload(response: Response, __=Depends(auth)) -> Response:
-        response.headers["Tus-Extension"] = tus_extension
-        response.headers["Tus-Resumable"] = tus_version
-        response.headers["Tus-Version"] = tus_version
-        response.headers["Tus-Max-Size"] = str(max_size)
-        response.headers["Content-Length"] = str(0)
+    async def options_create_upload(response: Response, __=Depends(auth)) -> Response:
+        response.headers.update(create_options_headers)
         response.status_code = status.HTTP_204_NO_CONTENT
         return response
 
@@ -204,19 +341,29 @@ def create_tus_router(
             raise HTTPException(status_code=400, detail="Invalid Upload-Defer-Length")
 
         defer_length = upload_defer_length is not None
+        if upload_length is None and not defer_length:
+            raise HTTPException(
+                status_code=400,
+                detail="Upload-Length or Upload-Defer-Length header required",
+            )
 
         # Create a new upload and store the file and metadata in the mapping
         metadata = {}
         if upload_metadata is not None and upload_metadata != "":
-            # Decode the base64-encoded string
-            for kv in upload_metadata.split(","):
-                key, value = kv.rsplit(" ", 1)
-                decoded_value = base64.b64decode(value.strip()).decode("utf-8")
-                metadata[key.strip()] = decoded_value
+            # Decode the base64-encoded values; keys may come without a value
+            metadata = _parse_upload_metadata(upload_metadata)
+        filename, filetype = _resolve_file_info(metadata)
 
         uuid = str(uuid4().hex)
 
         date_expiry = datetime.now() + timedelta(days=days_to_keep)
+
+        # deleting each upload at its expiry needs an asyncio loop; on other
+        # backends (e.g. trio) only the remove_expired_files() sweep applies
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
         saved_meta_data = FileMetadata.from_request(
             uuid,
             metadata,
@@ -225,57 +372,72 @@ def create_tus_router(
             defer_length,
             str(date_expiry.isoformat()),
         )
+        # metadata is immutable, so resolve and encode it for HEAD just once
+        saved_meta_data.filename = filename
+        saved_meta_data.filetype = filetype
+        saved_meta_data.upload_metadata = _encode_upload_metadata(filename, filetype)
+        _initialize_file(uuid, None if defer_length else upload_length)
         _write_metadata(saved_meta_data)
-        _initialize_file(uuid)
+
+        # delete the upload once it expires, rather than waiting for the
+        # next remove_expired_files() sweep to find it
+        if loop is not None:
+            delay = (date_expiry - datetime.now()).total_seconds()
+            expiry_timers[uuid] = (
+                loop,
+                # unlink in the default executor, not on the loop itself
+                loop.call_later(
+                    delay, loop.run_in_executor, None, _delete_files, uuid
+                ),
+            )
 
         response.headers["Location"] = _build_location_url(request=request, uuid=uuid)
         response.headers["Tus-Resumable"] = tus_version
         response.headers["Content-Length"] = str(0)
         response.status_code = status.HTTP_201_CREATED
 
-        meta = _read_metadata(uuid)
-        if meta and meta.size == 0:
+        if saved_meta_data.size == 0:
             file_path = os.path.join(files_dir, uuid)
-            result = on_complete(file_path, meta.metadata)
-            # if the callback returned a coroutine, await it
-            if inspect.isawaitable(result):
-                await result
+            await _run_on_complete(on_complete, file_path, saved_meta_data.metadata)
 
         return response
 
     @router.options("/{uuid}", status_code=status.HTTP_204_NO_CONTENT)
-    def options_upload_chunk(
+    async def options_upload_chunk(
         response: Response, uuid: str, _=Depends(auth)
     ) -> Response:
         meta = _read_metadata(uuid)
         if meta is None or not _file_exists(uuid):
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
-        response.headers["Tus-Extension"] = tus_extension
-        response.headers["Tus-Resumable"] = tus_version
-        response.headers["Tus-Version"] = tus_version
-        response.headers["Content-Length"] = str(0)
+        response.headers.update(upload_options_headers)
         response.status_code = status.HTTP_204_NO_CONTENT
         return response
 
     @router.get("/{uuid}")
-    def get_upload(uuid: str) -> FileResponse:
+    async def get_upload(uuid: str) -> ZeroCopyFileResponse:
         meta = _read_metadata(uuid)
+        file_stat = _stat_file(uuid)
 
         # Check if the upload ID is valid
-        if not meta or uuid != meta.uid or not _file_exists(uuid):
+        if not meta or uuid != meta.uid or file_stat is None:
             raise HTTPException(status_code=404, detail="Upload not found")
 
-        # Return the file in the response
-        return FileResponse(
+        # Return the file in the response; Content-Length comes from the same
+        # stat as the body, since the sidecar offset may lag behind the file
+        return ZeroCopyFileResponse(
             os.path.join(files_dir, uuid),
             media_type="application/octet-stream",
-            filename=meta.metadata["name"],
-            headers={"Content-Length": str(meta.offset), "Tus-Resumable": tus_version},
+            # sidecars written before filename was stored only have metadata;
+            # the download needs no filetype, so do not require one here
+            filename=meta.filename
+            or meta.metadata.get("filename", meta.metadata.get("name")),
+            headers={"Tus-Resumable": tus_version},
+            stat_result=file_stat,
         )
 
     @router.delete("/{uuid}", status_code=status.HTTP_204_NO_CONTENT)
-    def delete_upload(uuid: str, response: Response, _=Depends(auth)) -> Response:
+    async def delete_upload(uuid: str, response: Response, _=Depends(auth)) -> Response:
         meta = _read_metadata(uuid)
 
         # Check if the upload ID is valid
@@ -283,7 +445,7 @@ def create_tus_router(
             raise HTTPException(status_code=404, detail="Upload not found")
 
         # Delete the file and metadata for the upload from the mapping
-        _delete_files(uuid)
+        await run_in_threadpool(_delete_files, uuid)
 
         # Return a 204 No Content response
         response.headers["Tus-Resumable"] = tus_version
@@ -291,76 +453,142 @@ def create_tus_router(
         return response
 
     def _write_metadata(meta: FileMetadata) -> None:
-        if not os.path.exists(files_dir):
-            os.makedirs(files_dir)
+        # files_dir is created along with the upload file. Each save writes
+        # compact JSON to a temporary file and renames it over the sidecar,
+        # so concurrent readers never see a truncated or half-written file.
+        data = memoryview(json.dumps(asdict(meta)).encode("utf-8"))
+        fpath = os.path.join(files_dir, f"{meta.uid}.info")
+        tmp_path = f"{fpath}.{uuid4().hex}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            try:
+                while data:
+                    data = data[os.write(fd, data) :]
+                # the renamed file keeps this inode, mtime and size
+                info_stat = os.fstat(fd)
+            finally:
+                os.close(fd)
+            os.replace(tmp_path, fpath)
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+        # keep what was just written cached, so the next request on this
+        # upload does not have to parse it back
+        _cache_metadata(meta, info_stat)
+
+    def _cache_metadata(meta: FileMetadata, info_stat: os.stat_result) -> None:
+        if meta.uid not in metadata_cache and len(metadata_cache) >= metadata_cache_size:
+            metadata_cache.pop(next(iter(metadata_cache)), None)
+        metadata_cache[meta.uid] = (
+            info_stat.st_mtime_ns,
+            info_stat.st_size,
+            _copy_metadata(meta),
+        )
 
-        with open(os.path.join(files_dir, f"{meta.uid}.info"), "w") as f:
-            f.write(json.dumps(meta, indent=4, default=lambda k: k.__dict__))
+    def _copy_metadata(meta: FileMetadata) -> FileMetadata:
+        # callers (and user callbacks) update metadata in place, so cached
+        # entries are never shared with them
+        return replace(meta, metadata=dict(meta.metadata))
 
-    def _initialize_file(uid: str) -> None:
+    def _initialize_file(uid: str, size: int | None = None) -> None:
         if not os.path.exists(files_dir):
             os.makedirs(files_dir)
 
-        open(os.path.join(files_dir, f"{uid}"), "a").close()
+        fd = os.open(os.path.join(files_dir, f"{uid}"), os.O_WRONLY | os.O_CREAT)
+        try:
+            # reserve space for uploads of known, allowed size (opt-in, since
+            # the space is claimed before any bytes have been received)
+            if preallocate and size and size <= max_size:
+                fs.preallocate(fd, size)
+        finally:
+            os.close(fd)
 
     def _read_metadata(uid: str) -> FileMetadata | None:
         fpath = os.path.join(files_dir, f"{uid}.info")
-        if not os.path.exists(fpath):
-            return None
-
         try:
-            with open(fpath, "r") as f:
-                data = json.load(f)  # if this fails, we’ll catch below
-            return FileMetadata(**data)
+            info_stat = os.stat(fpath)
+            cached = metadata_cache.get(uid)
+            if cached is not None and cached[:2] == (
+                info_stat.st_mtime_ns,
+                info_stat.st_size,
+            ):
+                meta = cached[2]
+            else:
+                with open(fpath, "r") as f:
+                    data = json.load(f)  # if this fails, we’ll catch below
+                meta = FileMetadata(**data)
+                _cache_metadata(meta, info_stat)
         except (JSONDecodeError, TypeError, OSError):
-            # If the file exists but is empty/invalid, treat it as “no metadata.”
+            # If the file is missing, empty or invalid, treat it as “no metadata.”
             return None
 
-    def _get_file(uid: str) -> bytes | None:
-        fpath = os.path.join(files_dir, uid)
-        if os.path.exists(fpath):
-            with open(fpath, "rb") as f:
-                return f.read()
-
-        return None
+        return _copy_metadata(meta)
 
     def _file_exists(uid: str) -> bool:
         return os.path.exists(os.path.join(files_dir, uid))
 
-    def _get_file_length(uid: str) -> int:
-        return os.path.getsize(os.path.join(files_dir, uid))
+    def _stat_file(uid: str) -> os.stat_result | None:
+        try:
+            return os.stat(os.path.join(files_dir, uid))
+        except FileNotFoundError:
+            return None
 
     def _delete_files(uid: str) -> None:
         fpath = os.path.join(files_dir, uid)
-        if os.path.exists(fpath):
+        with suppress(FileNotFoundError):
             os.remove(fpath)
 
-        meta_path = os.path.join(files_dir, f"{uid}.info")
-        if os.path.exists(meta_path):
-            os.remove(meta_path)
+        with suppress(FileNotFoundError):
+            os.remove(f"{fpath}.info")
+        metadata_cache.pop(uid, None)
+
+        timer = expiry_timers.pop(uid, None)
+        if timer is not None:
+            loop, handle = timer
+            # may run outside the loop, e.g. from a scheduled sweep
+            with suppress(RuntimeError):
+                loop.call_soon_threadsafe(handle.cancel)
 
     def _get_and_save_the_file(
         response: Response,
         uuid: str,
+        meta: FileMetadata | None,
         content_length: int = Header(None),
-        upload_length: int = Header(None),
+        upload_offset: int = Header(None),
+        upload_length: int | None = None,
     ):
-        meta = _read_metadata(uuid)
         # Check if the upload ID is valid
         if not meta or uuid != meta.uid:
             raise HTTPException(status_code=404)
 
         # Check if the Upload Offset with Content-Length header is correct
-        if meta.offset != upload_length + content_length:
+        if meta.offset != upload_offset + content_length:
             raise HTTPException(status_code=409)
 
-        if meta.defer_length:
+        # the chunk dependency already saved meta; only write it again if
+        # something changed here
+        changed = False
+        if upload_length is not None and upload_length != meta.size:
+            # a deferred length may be declared once, and never below what
+            # has already been received
+            if meta.size is not None or upload_length < meta.offset:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Invalid Upload-Length",
+                )
+            if upload_length > max_size:
+                raise HTTPException(status_code=413)
             meta.size = upload_length
+            changed = True
 
         if not meta.expires:
             date_expiry = datetime.now() + timedelta(days=days_to_keep)
             meta.expires = str(date_expiry.isoformat())
-        _write_metadata(meta)
+            changed = True
+
+        if changed:
+            _write_metadata(meta)
 
         if meta.size == meta.offset:
             response.headers["Tus-Resumable"] = tus_version
@@ -369,9 +597,6 @@ def create_tus_router(
             )
             response.headers["Upload-Expires"] = str(meta.expires)
             response.status_code = status.HTTP_204_NO_CONTENT
-            if on_upload_complete:
-                on_upload_complete(os.path.join(files_dir, f"{uuid}"), meta.metadata)
-
             return response
 
         response.headers["Tus-Resumable"] = tus_version
@@ -381,30 +606,38 @@ def create_tus_router(
         return response
 
     def remove_expired_files():
-        file_list = os.listdir(files_dir)
-
-        file_list_to_remove = []
-
-        for f in file_list:
-            if len(f) == 32:
-                file_list_to_remove.append(f)
-
+        # scandir exposes the entry type from the directory listing itself,
+        # so filtering uploads costs no extra stat per file
+        try:
+            with os.scandir(files_dir) as entries:
+                file_list_to_remove = [
+                    entry.name
+                    for entry in entries
+                    if len(entry.name) == 32 and entry.is_file(follow_symlinks=False)
+                ]
+        except FileNotFoundError:
+            # nothing has been uploaded yet
+            return
+
+        now = datetime.now()
         for f in file_list_to_remove:
             meta = _read_metadata(f)
-            if meta.expires and datetime.fromisoformat(meta.expires) < datetime.now():
+            if meta and meta.expires and datetime.fromisoformat(meta.expires) < now:
                 _delete_files(f)
 
     def _get_host_and_proto(request: Request) -> tuple:
-        proto = "http"
-        host = request.headers.get("host")
-        if request.headers.get("X-Forwarded-Proto") is not None:
-            proto = request.headers.get("X-Forwarded-Proto")
-        if request.headers.get("X-Forwarded-Host") is not None:
-            host = request.headers.get("X-Forwarded-Host")
+        headers = request.headers
+        proto = headers.get("X-Forwarded-Proto", "http")
+        host = headers.get("X-Forwarded-Host")
+        if host is None:
+            host = headers.get("host", "")
         return proto, host
 
     def _build_location_url(request: Request, uuid: str) -> str:
         proto, host = _get_host_and_proto(request=request)
-        return f"{proto}://{host}/{prefix}/{uuid}"
+        return "".join((proto, "://", host, location_path, uuid))
+
+    # expose the cleanup sweep so it can be scheduled by the application
+    router.remove_expired_files = remove_expired_files
 
     return router